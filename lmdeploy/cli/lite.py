@@ -1,21 +1,17 @@
 # Copyright (c) OpenMMLab. All rights reserved.
-from mmengine.config import DictAction
-
 from .cli import CLI
-from .utils import ArgumentHelper, DefaultsAndTypesHelpFormatter, convert_args
+from .utils import (ArgumentHelper, DefaultsAndTypesHelpFormatter, DictAction,
+                    convert_args)
 
 
 class SubCliLite(object):
     """CLI for compressing LLMs."""
     _help = 'Compressing and accelerating LLMs with lmdeploy.lite module'
     _desc = _help
-    parser = CLI.subparsers.add_parser(
-        'lite',
-        help=_help,
-        description=_desc,
-    )
-    subparsers = parser.add_subparsers(
-        title='Commands', description='This group has the following commands:')
+    # created by `add_parsers`, so that importing this module does not
+    # touch the argparse graph
+    parser = None
+    subparsers = None
 
     @staticmethod
     def add_parser_auto_awq():
@@ -162,6 +158,14 @@ class SubCliLite(object):
     @staticmethod
     def add_parsers():
         """Add all parsers."""
+        SubCliLite.parser = CLI.subparsers.add_parser(
+            'lite',
+            help=SubCliLite._help,
+            description=SubCliLite._desc,
+        )
+        SubCliLite.subparsers = SubCliLite.parser.add_subparsers(
+            title='Commands',
+            description='This group has the following commands:')
         SubCliLite.add_parser_auto_awq()
         SubCliLite.add_parser_calibrate()
         SubCliLite.add_parser_kv_qparams()
@@ -1,6 +1,7 @@
 # Copyright (c) OpenMMLab. All rights reserved.
 
 import argparse
+import ast
 from typing import List
 
 
@@ -21,6 +22,35 @@ class DefaultsAndTypesHelpFormatter(argparse.HelpFormatter):
         return help
 
 
+class DictAction(argparse.Action):
+    """Argparse action to collect `key=value` pairs into a dict.
+
+    Values are parsed as python literals when possible, e.g. `a=1` gives
+    `{'a': 1}` and `b=[1,2]` gives `{'b': [1, 2]}`. Otherwise they are kept
+    as strings.
+    """
+
+    @staticmethod
+    def _parse_value(value: str):
+        """Parse a value string into a python object."""
+        if value.lower() in ['true', 'false']:
+            return value.lower() == 'true'
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return value
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        options = dict(getattr(namespace, self.dest, None) or {})
+        for kv in values:
+            if '=' not in kv:
+                parser.error(f'{option_string} expects key=value pairs, '
+                             f'but given: {kv}')
+            key, value = kv.split('=', maxsplit=1)
+            options[key] = self._parse_value(value)
+        setattr(namespace, self.dest, options)
+
+
 def convert_args(args):
     """Convert args to dict format."""
     special_names = ['run', 'command']
@@ -3,7 +3,6 @@
 import os.path as osp
 import shutil
 
-import fire
 import torch
 from torch import nn
 
@@ -162,4 +161,6 @@ def smooth_quant(model: str,
 
 
 if __name__ == '__main__':
+    import fire
+
     fire.Fire(smooth_quant)
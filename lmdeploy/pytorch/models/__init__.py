@@ -1,5 +1,16 @@
 # Copyright (c) OpenMMLab. All rights reserved.
 from .patch import patch
-from .q_modules import QLinear, QRMSNorm
 
 __all__ = ['patch', 'QLinear', 'QRMSNorm']
+
+# `q_modules` pulls in the w8a8 triton kernels, load it on first access
+_LAZY_Q_MODULES = ('QLinear', 'QRMSNorm')
+
+
+def __getattr__(name: str):
+    if name in _LAZY_Q_MODULES:
+        from . import q_modules
+        value = getattr(q_modules, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,74 +1,129 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+import os
+import time
 from threading import Lock
 from typing import Sequence
 
 import gradio as gr
+import requests
+from requests.adapters import HTTPAdapter
 
 from lmdeploy.serve.gradio.constants import CSS, THEME, disable_btn, enable_btn
 from lmdeploy.serve.openai.api_client import (get_model_list,
                                               get_streaming_response)
 
+# minimum interval in seconds between two refreshes of the chatbot
+STREAM_INTERVAL = 0.033
+
 
 class InterFace:
     api_server_url: str = None
+    chat_interactive_url: str = None
+    session: requests.Session = None
     global_session_id: int = 0
     lock = Lock()
 
 
 def chat_stream_restful(instruction: str, state_chatbot: Sequence,
-                        cancel_btn: gr.Button, reset_btn: gr.Button,
-                        session_id: int, top_p: float, temperature: float,
-                        request_output_len: int):
+                        state_messages: Sequence, cancel_btn: gr.Button,
+                        reset_btn: gr.Button, session_id: int, top_p: float,
+                        temperature: float, request_output_len: int):
     """Chat with AI assistant.
 
     Args:
         instruction (str): user's prompt
         state_chatbot (Sequence): the chatting history
+        state_messages (Sequence): the chatting history in OpenAI format
         session_id (int): the session id
     """
     state_chatbot = state_chatbot + [(instruction, None)]
+    state_messages = state_messages + [dict(role='user', content=instruction)]
+    reply = dict(role='assistant', content=None)
+
+    yield (state_chatbot, state_chatbot, state_messages, disable_btn,
+           enable_btn)
+
+    # collect the pieces received since the last refresh and fold them into
+    # the reply on display, instead of growing one string token by token
+    chunks = []
+    last_emit = time.monotonic()
+    warned_length = False
+    warned_old = False
+    finished = False
 
-    yield (state_chatbot, state_chatbot, disable_btn, enable_btn)
+    def _refresh():
+        if reply['content'] is None:
+            reply['content'] = ''
+            state_messages.append(reply)
+        reply['content'] += ''.join(chunks)
+        chunks.clear()
+        state_chatbot[-1] = (instruction, reply['content'])
 
     for response, tokens, finish_reason in get_streaming_response(
             instruction,
-            f'{InterFace.api_server_url}/v1/chat/interactive',
+            InterFace.chat_interactive_url,
+            session=InterFace.session,
             session_id=session_id,
             request_output_len=request_output_len,
             interactive_mode=True,
             top_p=top_p,
             temperature=temperature):
-        if finish_reason == 'length' and tokens == 0:
+        if finished:
+            # read the response to its end, so that the connection goes back
+            # to the pool of `InterFace.session`
+            continue
+        # warn once per stream rather than on every piece
+        if finish_reason == 'length' and tokens == 0 and not warned_length:
+            warned_length = True
             gr.Warning('WARNING: exceed session max length.'
                        ' Please restart the session by reset button.')
-        if tokens < 0:
+        if tokens < 0 and not warned_old:
+            warned_old = True
             gr.Warning('WARNING: running on the old session.'
                        ' Please restart the session by reset button.')
-        if state_chatbot[-1][-1] is None:
-            state_chatbot[-1] = (state_chatbot[-1][0], response)
-        else:
-            state_chatbot[-1] = (state_chatbot[-1][0],
-                                 state_chatbot[-1][1] + response
-                                 )  # piece by piece
-        yield (state_chatbot, state_chatbot, enable_btn, disable_btn)
+        chunks.append(response)
+        # refresh the chatbot at a bounded rate. The finishing piece is
+        # always shown
+        now = time.monotonic()
+        if finish_reason is None and now - last_emit < STREAM_INTERVAL:
+            continue
+        last_emit = now
+        _refresh()
+        if finish_reason is not None:
+            # the finishing piece also restores the buttons
+            yield (state_chatbot, state_chatbot, state_messages, disable_btn,
+                   enable_btn)
+            finished = True
+            continue
+        yield (state_chatbot, state_chatbot, state_messages, enable_btn,
+               disable_btn)
 
-    yield (state_chatbot, state_chatbot, disable_btn, enable_btn)
+    if finished:
+        return
+    # the stream ended without a finish_reason
+    if chunks:
+        _refresh()
+    yield (state_chatbot, state_chatbot, state_messages, disable_btn,
+           enable_btn)
 
 
 def reset_restful_func(instruction_txtbox: gr.Textbox, state_chatbot: gr.State,
-                       session_id: int):
+                       state_messages: gr.State, session_id: int):
     """reset the session.
 
     Args:
         instruction_txtbox (str): user's prompt
         state_chatbot (Sequence): the chatting history
+        state_messages (Sequence): the chatting history in OpenAI format
         session_id (int): the session id
     """
     state_chatbot = []
+    state_messages = []
     # end the session
     for response, tokens, finish_reason in get_streaming_response(
             '',
-            f'{InterFace.api_server_url}/v1/chat/interactive',
+            InterFace.chat_interactive_url,
+            session=InterFace.session,
             session_id=session_id,
             request_output_len=0,
             interactive_mode=False):
@@ -77,50 +132,48 @@ def reset_restful_func(instruction_txtbox: gr.Textbox, state_chatbot: gr.State,
     return (
         state_chatbot,
         state_chatbot,
+        state_messages,
         gr.Textbox.update(value=''),
     )
 
 
-def cancel_restful_func(state_chatbot: gr.State, cancel_btn: gr.Button,
-                        reset_btn: gr.Button, session_id: int):
+def cancel_restful_func(state_chatbot: gr.State, state_messages: gr.State,
+                        cancel_btn: gr.Button, reset_btn: gr.Button,
+                        session_id: int):
     """stop the session.
 
     Args:
         instruction_txtbox (str): user's prompt
         state_chatbot (Sequence): the chatting history
+        state_messages (Sequence): the chatting history in OpenAI format
         session_id (int): the session id
     """
     yield (state_chatbot, disable_btn, disable_btn)
     # stop the session
-    for out in get_streaming_response(
-            '',
-            f'{InterFace.api_server_url}/v1/chat/interactive',
-            session_id=session_id,
-            request_output_len=0,
-            cancel=True,
-            interactive_mode=True):
+    for out in get_streaming_response('',
+                                      InterFace.chat_interactive_url,
+                                      session=InterFace.session,
+                                      session_id=session_id,
+                                      request_output_len=0,
+                                      cancel=True,
+                                      interactive_mode=True):
         pass
     # end the session
-    for out in get_streaming_response(
-            '',
-            f'{InterFace.api_server_url}/v1/chat/interactive',
-            session_id=session_id,
-            request_output_len=0,
-            interactive_mode=False):
+    for out in get_streaming_response('',
+                                      InterFace.chat_interactive_url,
+                                      session=InterFace.session,
+                                      session_id=session_id,
+                                      request_output_len=0,
+                                      interactive_mode=False):
         pass
     # resume the session
     # TODO this is not proper if api server is running pytorch backend
-    messages = []
-    for qa in state_chatbot:
-        messages.append(dict(role='user', content=qa[0]))
-        if qa[1] is not None:
-            messages.append(dict(role='assistant', content=qa[1]))
-    for out in get_streaming_response(
-            messages,
-            f'{InterFace.api_server_url}/v1/chat/interactive',
-            session_id=session_id,
-            request_output_len=0,
-            interactive_mode=True):
+    for out in get_streaming_response(state_messages,
+                                      InterFace.chat_interactive_url,
+                                      session=InterFace.session,
+                                      session_id=session_id,
+                                      request_output_len=0,
+                                      interactive_mode=True):
         pass
     yield (state_chatbot, disable_btn, enable_btn)
 
@@ -138,6 +191,12 @@ def run_api_server(api_server_url: str,
         batch_size (int): batch size for running Turbomind directly
     """
     InterFace.api_server_url = api_server_url
+    InterFace.chat_interactive_url = f'{api_server_url}/v1/chat/interactive'
+    # keep the connections to api_server alive for the concurrent users
+    adapter = HTTPAdapter(pool_maxsize=batch_size)
+    InterFace.session = requests.Session()
+    InterFace.session.mount('http://', adapter)
+    InterFace.session.mount('https://', adapter)
     model_names = get_model_list(f'{api_server_url}/v1/models')
     model_name = ''
     if isinstance(model_names, list) and len(model_names) > 0:
@@ -147,6 +206,7 @@ def run_api_server(api_server_url: str,
 
     with gr.Blocks(css=CSS, theme=THEME) as demo:
         state_chatbot = gr.State([])
+        state_messages = gr.State([])
         state_session_id = gr.State(0)
 
         with gr.Column(elem_id='container'):
@@ -173,23 +233,23 @@ def run_api_server(api_server_url: str,
                                         label='Temperature')
 
         send_event = instruction_txtbox.submit(chat_stream_restful, [
-            instruction_txtbox, state_chatbot, cancel_btn, reset_btn,
-            state_session_id, top_p, temperature, request_output_len
-        ], [state_chatbot, chatbot, cancel_btn, reset_btn])
+            instruction_txtbox, state_chatbot, state_messages, cancel_btn,
+            reset_btn, state_session_id, top_p, temperature, request_output_len
+        ], [state_chatbot, chatbot, state_messages, cancel_btn, reset_btn])
         instruction_txtbox.submit(
             lambda: gr.Textbox.update(value=''),
             [],
             [instruction_txtbox],
         )
-        cancel_btn.click(
-            cancel_restful_func,
-            [state_chatbot, cancel_btn, reset_btn, state_session_id],
-            [state_chatbot, cancel_btn, reset_btn],
-            cancels=[send_event])
-
-        reset_btn.click(reset_restful_func,
-                        [instruction_txtbox, state_chatbot, state_session_id],
-                        [state_chatbot, chatbot, instruction_txtbox],
+        cancel_btn.click(cancel_restful_func, [
+            state_chatbot, state_messages, cancel_btn, reset_btn,
+            state_session_id
+        ], [state_chatbot, cancel_btn, reset_btn],
+                         cancels=[send_event])
+
+        reset_btn.click(reset_restful_func, [
+            instruction_txtbox, state_chatbot, state_messages, state_session_id
+        ], [state_chatbot, chatbot, state_messages, instruction_txtbox],
                         cancels=[send_event])
 
         def init():
@@ -200,11 +260,13 @@ def run_api_server(api_server_url: str,
 
         demo.load(init, inputs=None, outputs=[state_session_id])
 
+    # negotiating a public share link blocks the launch, opt in to it
+    share = os.environ.get('LMDEPLOY_GRADIO_SHARE', '0') == '1'
     print(f'server is gonna mount on: http://{server_name}:{server_port}')
     demo.queue(concurrency_count=batch_size, max_size=100,
                api_open=True).launch(
-                   max_threads=10,
-                   share=True,
+                   max_threads=max(batch_size * 2, 32),
+                   share=share,
                    server_port=server_port,
                    server_name=server_name,
                )
@@ -1,25 +1,61 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+import inspect
 import json
+import sys
 from typing import Any, Dict, Iterable, List, Optional, Union
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from lmdeploy.utils import get_logger
 
+try:
+    # faster to decode the json frames of a stream if available
+    import orjson
+except ImportError:
+    orjson = None
+
+_DATA_PREFIX = b'data:'
+_DONE = b'[DONE]'
+# the other fields of server-sent events, which carry no json payload
+_SSE_FIELDS = (b'event:', b'id:', b'retry:')
+
+# compressing small token frames only delays them, ask for none on streaming
+_IDENTITY_ENCODING = {'Accept-Encoding': 'identity'}
+
+# headers of `get_streaming_response`. requests merges them into a new dict
+# per request, so they are shared across calls
+_STREAMING_HEADERS = {
+    'User-Agent': 'Test Client',
+    'content-type': 'application/json',
+    **_IDENTITY_ENCODING
+}
+
+
+def _fetch_models(api_url: str,
+                  headers: Optional[Dict[str, str]] = None,
+                  session: Optional[requests.Session] = None) -> List[str]:
+    """Query the model names served at `api_url`."""
+    get = requests.get if session is None else session.get
+    response = get(api_url, headers=headers)
+    model_list = json_loads(response.content)
+    model_list = model_list.pop('data', [])
+    return [item['id'] for item in model_list]
+
 
 def get_model_list(api_url: str):
     """Get model list from api server."""
-    response = requests.get(api_url)
-    if hasattr(response, 'text'):
-        model_list = json.loads(response.text)
-        model_list = model_list.pop('data', [])
-        return [item['id'] for item in model_list]
-    return None
+    return _fetch_models(api_url)
 
 
 def json_loads(content):
-    """Loads content to json format."""
+    """Loads content to json format.
+
+    `content` can be str or utf-8 encoded bytes.
+    """
     try:
+        if orjson is not None:
+            return orjson.loads(content)
         content = json.loads(content)
         return content
     except:  # noqa
@@ -28,6 +64,78 @@ def json_loads(content):
         return ''
 
 
+def json_dumps(content) -> bytes:
+    """Dumps content to utf-8 encoded json bytes."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content).encode('utf-8')
+
+
+def _split_lines(buf: bytearray, data: bytes) -> List[bytes]:
+    """Append `data` to `buf` and pop the complete lines out of it.
+
+    Pending bytes are kept in `buf` and scanned in place, so only one bytes
+    object is created per line rather than per network chunk.
+    """
+    buf += data
+    lines = []
+    start = 0
+    end = buf.find(b'\n')
+    while end != -1:
+        lines.append(bytes(buf[start:end]))
+        start = end + 1
+        end = buf.find(b'\n', start)
+    del buf[:start]
+    return lines
+
+
+def _iter_lines(response: requests.Response, chunk_size: int = 65536):
+    """Yield the newline separated lines of a response."""
+    buf = bytearray()
+    for data in response.iter_content(chunk_size=chunk_size):
+        yield from _split_lines(buf, data)
+    if buf:
+        yield bytes(buf)
+
+
+async def _aiter_lines(response):
+    """Yield the newline separated lines of an httpx response."""
+    buf = bytearray()
+    async for data in response.aiter_bytes():
+        for line in _split_lines(buf, data):
+            yield line
+    if buf:
+        yield bytes(buf)
+
+
+def _sse_payload(line: bytes) -> Optional[bytes]:
+    """Get the json payload of a response line.
+
+    Server-sent events are unwrapped from the `data:` prefix, while their
+    comment lines, other fields, empty keepalive data and the [DONE] sentinel
+    carry no payload. Plain json lines are returned as they are. Return None
+    if there is no payload, so that no json parsing is spent on it.
+    """
+    if not line or line.startswith(b':') or line.startswith(_SSE_FIELDS):
+        return None
+    if line.startswith(_DATA_PREFIX):
+        line = line[len(_DATA_PREFIX):]
+        # the space after the field name is optional
+        if line.startswith(b' '):
+            line = line[1:]
+        if not line or line == _DONE:
+            return None
+    return line
+
+
+def _iter_sse(response: requests.Response):
+    """Yield the json objects in the lines of a response."""
+    for line in _iter_lines(response):
+        payload = _sse_payload(line)
+        if payload is not None:
+            yield json_loads(payload)
+
+
 class APIClient:
     """Chatbot for LLaMA series models with turbomind as inference engine.
 
@@ -38,34 +146,44 @@ class APIClient:
             api key will be used.
     """
 
+    __slots__ = ('api_server_url', 'chat_intractive_v1_url',
+                 'chat_completions_v1_url', 'completions_v1_url',
+                 'models_v1_url', 'encode_v1_url', '_available_models',
+                 'api_key', 'headers', '_stream_headers', '_session')
+
+    # suffixes of the urls below, in the order they are assigned
+    _URL_SUFFIXES = ('/v1/chat/interactive', '/v1/chat/completions',
+                     '/v1/completions', '/v1/models', '/v1/encode')
+
     def __init__(self,
                  api_server_url: str,
                  api_key: Optional[str] = None,
                  **kwargs):
         self.api_server_url = api_server_url
-        self.chat_intractive_v1_url = f'{api_server_url}/v1/chat/interactive'
-        self.chat_completions_v1_url = f'{api_server_url}/v1/chat/completions'
-        self.completions_v1_url = f'{api_server_url}/v1/completions'
-        self.models_v1_url = f'{api_server_url}/v1/models'
-        self.encode_v1_url = f'{api_server_url}/v1/encode'
+        (self.chat_intractive_v1_url, self.chat_completions_v1_url,
+         self.completions_v1_url, self.models_v1_url,
+         self.encode_v1_url) = (api_server_url + suffix
+                                for suffix in self._URL_SUFFIXES)
         self._available_models = None
         self.api_key = api_key
         self.headers = {'content-type': 'application/json'}
         if api_key is not None:
             self.headers['Authorization'] = f'Bearer {api_key}'
+        self._stream_headers = dict(self.headers, **_IDENTITY_ENCODING)
+        # reuse the connections to the server across requests
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
 
     @property
     def available_models(self):
         """Show available models."""
         if self._available_models is not None:
             return self._available_models
-        response = requests.get(self.models_v1_url, headers=self.headers)
-        if hasattr(response, 'text'):
-            model_list = json_loads(response.text)
-            model_list = model_list.pop('data', [])
-            self._available_models = [item['id'] for item in model_list]
-            return self._available_models
-        return None
+        self._available_models = _fetch_models(self.models_v1_url,
+                                               self.headers, self._session)
+        return self._available_models
 
     def encode(self,
                input: Union[str, List[str]],
@@ -80,16 +198,15 @@ class APIClient:
                 when it is not. Default to True.
         Return: (input_ids, length)
         """
-        response = requests.post(self.encode_v1_url,
-                                 headers=self.headers,
-                                 json=dict(input=input,
-                                           do_preprocess=do_preprocess,
-                                           add_bos=add_bos),
-                                 stream=False)
-        if hasattr(response, 'text'):
-            output = json_loads(response.text)
-            return output['input_ids'], output['length']
-        return None, None
+        response = self._session.post(self.encode_v1_url,
+                                      headers=self.headers,
+                                      data=json_dumps(
+                                          dict(input=input,
+                                               do_preprocess=do_preprocess,
+                                               add_bos=add_bos)),
+                                      stream=False)
+        output = json_loads(response.content)
+        return output['input_ids'], output['length']
 
     def chat_completions_v1(self,
                             model: str,
@@ -135,30 +252,29 @@ class APIClient:
             json objects in openai formats
         """
         pload = {
-            k: v
-            for k, v in locals().copy().items()
-            if k[:2] != '__' and k not in ['self']
+            'model': model,
+            'messages': messages,
+            'temperature': temperature,
+            'top_p': top_p,
+            'n': n,
+            'max_tokens': max_tokens,
+            'stop': stop,
+            'stream': stream,
+            'presence_penalty': presence_penalty,
+            'frequency_penalty': frequency_penalty,
+            'user': user,
+            'repetition_penalty': repetition_penalty,
+            'session_id': session_id,
+            'ignore_eos': ignore_eos,
+            'skip_special_tokens': skip_special_tokens
         }
-        response = requests.post(self.chat_completions_v1_url,
-                                 headers=self.headers,
-                                 json=pload,
-                                 stream=stream)
-        for chunk in response.iter_lines(chunk_size=8192,
-                                         decode_unicode=False,
-                                         delimiter=b'\n'):
-            if chunk:
-                if stream:
-                    decoded = chunk.decode('utf-8')
-                    if decoded == 'data: [DONE]':
-                        continue
-                    if decoded[:6] == 'data: ':
-                        decoded = decoded[6:]
-                    output = json_loads(decoded)
-                    yield output
-                else:
-                    decoded = chunk.decode('utf-8')
-                    output = json_loads(decoded)
-                    yield output
+        pload.update(kwargs)
+        headers = self._stream_headers if stream else self.headers
+        response = self._session.post(self.chat_completions_v1_url,
+                                      headers=headers,
+                                      data=json_dumps(pload),
+                                      stream=stream)
+        yield from _iter_sse(response)
 
     def chat_interactive_v1(self,
                             prompt: Union[str, List[Dict[str, str]]],
@@ -217,21 +333,28 @@ class APIClient:
                 history_tokens, finish_reason
         """
         pload = {
-            k: v
-            for k, v in locals().copy().items()
-            if k[:2] != '__' and k not in ['self']
+            'prompt': prompt,
+            'image_url': image_url,
+            'session_id': session_id,
+            'interactive_mode': interactive_mode,
+            'stream': stream,
+            'stop': stop,
+            'request_output_len': request_output_len,
+            'top_p': top_p,
+            'top_k': top_k,
+            'temperature': temperature,
+            'repetition_penalty': repetition_penalty,
+            'ignore_eos': ignore_eos,
+            'skip_special_tokens': skip_special_tokens,
+            'adapter_name': adapter_name
         }
-        response = requests.post(self.chat_intractive_v1_url,
-                                 headers=self.headers,
-                                 json=pload,
-                                 stream=stream)
-        for chunk in response.iter_lines(chunk_size=8192,
-                                         decode_unicode=False,
-                                         delimiter=b'\n'):
-            if chunk:
-                decoded = chunk.decode('utf-8')
-                output = json_loads(decoded)
-                yield output
+        pload.update(kwargs)
+        headers = self._stream_headers if stream else self.headers
+        response = self._session.post(self.chat_intractive_v1_url,
+                                      headers=headers,
+                                      data=json_dumps(pload),
+                                      stream=stream)
+        yield from _iter_sse(response)
 
     def completions_v1(
             self,
@@ -283,30 +406,29 @@ class APIClient:
             json objects in openai formats
         """
         pload = {
-            k: v
-            for k, v in locals().copy().items()
-            if k[:2] != '__' and k not in ['self']
+            'model': model,
+            'prompt': prompt,
+            'suffix': suffix,
+            'temperature': temperature,
+            'n': n,
+            'max_tokens': max_tokens,
+            'stream': stream,
+            'stop': stop,
+            'top_p': top_p,
+            'top_k': top_k,
+            'user': user,
+            'repetition_penalty': repetition_penalty,
+            'session_id': session_id,
+            'ignore_eos': ignore_eos,
+            'skip_special_tokens': skip_special_tokens
         }
-        response = requests.post(self.completions_v1_url,
-                                 headers=self.headers,
-                                 json=pload,
-                                 stream=stream)
-        for chunk in response.iter_lines(chunk_size=8192,
-                                         decode_unicode=False,
-                                         delimiter=b'\n'):
-            if chunk:
-                if stream:
-                    decoded = chunk.decode('utf-8')
-                    if decoded == 'data: [DONE]':
-                        continue
-                    if decoded[:6] == 'data: ':
-                        decoded = decoded[6:]
-                    output = json_loads(decoded)
-                    yield output
-                else:
-                    decoded = chunk.decode('utf-8')
-                    output = json_loads(decoded)
-                    yield output
+        pload.update(kwargs)
+        headers = self._stream_headers if stream else self.headers
+        response = self._session.post(self.completions_v1_url,
+                                      headers=headers,
+                                      data=json_dumps(pload),
+                                      stream=stream)
+        yield from _iter_sse(response)
 
     def chat(self,
              prompt: str,
@@ -370,11 +492,140 @@ class APIClient:
                 If not specified with a value other than -1, using random value
                 directly.
         """
-        for out in self.chat_interactive_v1(prompt='',
-                                            session_id=session_id,
-                                            request_output_len=0,
-                                            interactive_mode=False):
-            pass
+        # nothing is generated, so post it and drop the answer instead of
+        # parsing it
+        pload = {
+            'prompt': '',
+            'session_id': session_id,
+            'request_output_len': 0,
+            'interactive_mode': False
+        }
+        self._session.post(self.chat_intractive_v1_url,
+                           headers=self.headers,
+                           data=json_dumps(pload)).close()
+
+
+def _bind_pload(method, args: tuple, kwargs: Dict[str, Any]):
+    """Build the payload of an `APIClient` request method from its arguments.
+
+    The arguments are bound to the signature of `method`, so that missing
+    ones take its defaults. Extra keyword arguments are merged in as the
+    method does.
+    """
+    bound = inspect.signature(method).bind(None, *args, **kwargs)
+    bound.apply_defaults()
+    pload = bound.arguments
+    del pload['self']
+    pload.update(pload.pop('kwargs'))
+    return pload
+
+
+class AsyncAPIClient:
+    """Asynchronous client of api_server built on `httpx.AsyncClient`.
+
+    Concurrent requests are awaited on one event loop and share the pooled
+    connections of the client, instead of taking a thread each as
+    `APIClient` does. The request methods take the same arguments and
+    defaults as the ones of `APIClient`, which are bound to them to build the
+    payloads.
+
+    Args:
+        api_server_url (str): communicating address 'http://<ip>:<port>' of
+            api_server
+        api_key (str | None): api key. Default to None, which means no
+            api key will be used.
+    """
+
+    __slots__ = ('api_server_url', 'chat_intractive_v1_url',
+                 'chat_completions_v1_url', 'completions_v1_url',
+                 'models_v1_url', '_available_models', 'api_key', 'headers',
+                 '_client')
+
+    # suffixes of the urls below, in the order they are assigned
+    _URL_SUFFIXES = ('/v1/chat/interactive', '/v1/chat/completions',
+                     '/v1/completions', '/v1/models')
+
+    def __init__(self,
+                 api_server_url: str,
+                 api_key: Optional[str] = None,
+                 **kwargs):
+        import httpx
+        self.api_server_url = api_server_url
+        (self.chat_intractive_v1_url, self.chat_completions_v1_url,
+         self.completions_v1_url,
+         self.models_v1_url) = (api_server_url + suffix
+                                for suffix in self._URL_SUFFIXES)
+        self._available_models = None
+        self.api_key = api_key
+        self.headers = {'content-type': 'application/json'}
+        if api_key is not None:
+            self.headers['Authorization'] = f'Bearer {api_key}'
+        self._client = httpx.AsyncClient(headers=self.headers, timeout=None)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the connections to the server."""
+        await self._client.aclose()
+
+    async def available_models(self):
+        """Show available models."""
+        if self._available_models is not None:
+            return self._available_models
+        response = await self._client.get(self.models_v1_url)
+        model_list = json_loads(response.content)
+        model_list = model_list.pop('data', [])
+        self._available_models = [item['id'] for item in model_list]
+        return self._available_models
+
+    async def _post(self, url: str, pload: Dict[str, Any]):
+        """Post the payload and yield the json objects of the response."""
+        headers = _IDENTITY_ENCODING if pload['stream'] else None
+        async with self._client.stream('POST',
+                                       url,
+                                       content=json_dumps(pload),
+                                       headers=headers) as response:
+            async for line in _aiter_lines(response):
+                payload = _sse_payload(line)
+                if payload is not None:
+                    yield json_loads(payload)
+
+    async def chat_completions_v1(self, *args, **kwargs):
+        """Chat completion v1. Takes the arguments of
+        `APIClient.chat_completions_v1`.
+
+        Yields:
+            json objects in openai formats
+        """
+        pload = _bind_pload(APIClient.chat_completions_v1, args, kwargs)
+        async for output in self._post(self.chat_completions_v1_url, pload):
+            yield output
+
+    async def chat_interactive_v1(self, *args, **kwargs):
+        """Interactive completions. Takes the arguments of
+        `APIClient.chat_interactive_v1`.
+
+        Yields:
+            json objects consist of text, tokens, input_tokens,
+                history_tokens, finish_reason
+        """
+        pload = _bind_pload(APIClient.chat_interactive_v1, args, kwargs)
+        async for output in self._post(self.chat_intractive_v1_url, pload):
+            yield output
+
+    async def completions_v1(self, *args, **kwargs):
+        """Completions v1. Takes the arguments of `APIClient.completions_v1`.
+
+        Yields:
+            json objects in openai formats
+        """
+        pload = _bind_pload(APIClient.completions_v1, args, kwargs)
+        async for output in self._post(self.completions_v1_url, pload):
+            yield output
 
 
 def input_prompt():
@@ -395,10 +646,16 @@ def get_streaming_response(
         cancel: bool = False,
         top_p: float = 0.8,
         temperature: float = 0.7,
-        api_key: Optional[str] = None) -> Iterable[List[str]]:
-    headers = {'User-Agent': 'Test Client'}
+        api_key: Optional[str] = None,
+        session: Optional[requests.Session] = None) -> Iterable[List[str]]:
+    """Stream text, tokens and finish_reason from the interactive api.
+
+    Pass a `requests.Session` by `session` to keep the connections to the
+    server alive across calls. Otherwise every call opens a new connection.
+    """
+    headers = _STREAMING_HEADERS
     if api_key is not None:
-        headers['Authorization'] = f'Bearer {api_key}'
+        headers = dict(headers, Authorization=f'Bearer {api_key}')
     pload = {
         'prompt': prompt,
         'stream': stream,
@@ -410,19 +667,14 @@ def get_streaming_response(
         'top_p': top_p,
         'temperature': temperature
     }
-    response = requests.post(api_url,
-                             headers=headers,
-                             json=pload,
-                             stream=stream)
-    for chunk in response.iter_lines(chunk_size=8192,
-                                     decode_unicode=False,
-                                     delimiter=b'\n'):
-        if chunk:
-            data = json_loads(chunk.decode('utf-8'))
-            output = data.pop('text', '')
-            tokens = data.pop('tokens', 0)
-            finish_reason = data.pop('finish_reason', None)
-            yield output, tokens, finish_reason
+    post = requests.post if session is None else session.post
+    response = post(api_url,
+                    headers=headers,
+                    data=json_dumps(pload),
+                    stream=stream)
+    for data in _iter_sse(response):
+        text, tokens = data.get('text', ''), data.get('tokens', 0)
+        yield text, tokens, data.get('finish_reason')
 
 
 def main(api_server_url: str,
@@ -430,6 +682,7 @@ def main(api_server_url: str,
          api_key: Optional[str] = None):
     """Main function to chat in terminal."""
     api_client = APIClient(api_server_url, api_key=api_key)
+    write, flush = sys.stdout.write, sys.stdout.flush
     while True:
         prompt = input_prompt()
         if prompt in ['exit', 'end']:
@@ -437,14 +690,18 @@ def main(api_server_url: str,
             if prompt == 'exit':
                 exit(0)
         else:
-            for text, tokens, finish_reason in api_client.chat(
-                    prompt,
-                    session_id=session_id,
-                    request_output_len=512,
-                    stream=True):
+            for i, (text, tokens, finish_reason) in enumerate(
+                    api_client.chat(prompt,
+                                    session_id=session_id,
+                                    request_output_len=512,
+                                    stream=True)):
                 if finish_reason == 'length':
                     continue
-                print(text, end='')
+                write(text)
+                # flush periodically to keep the output interactive
+                if i % 16 == 15:
+                    flush()
+            flush()
 
 
 if __name__ == '__main__':
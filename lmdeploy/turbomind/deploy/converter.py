@@ -5,7 +5,6 @@ import re
 import shutil
 from pathlib import Path
 
-import fire
 import torch
 
 from lmdeploy.archs import get_model_arch
@@ -320,4 +319,6 @@ def main(model_name: str,
 
 
 if __name__ == '__main__':
+    import fire
+
     fire.Fire(main)
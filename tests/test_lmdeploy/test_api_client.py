@@ -0,0 +1,271 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from lmdeploy.serve.openai.api_client import (APIClient, AsyncAPIClient,
+                                              _bind_pload, _iter_sse,
+                                              _split_lines, _sse_payload,
+                                              get_streaming_response)
+
+
+class _Response:
+    """Stand in for a `requests.Response` that yields the given chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def iter_content(self, chunk_size=None):
+        return iter(self.chunks)
+
+
+def test_split_lines():
+    buf = bytearray()
+    assert _split_lines(buf, b'data: {"a"') == []
+    assert _split_lines(buf, b': 1}\n\ndata: ') == [b'data: {"a": 1}', b'']
+    assert buf == b'data: '
+    assert _split_lines(buf, b'[DONE]\n') == [b'data: [DONE]']
+    assert buf == b''
+
+
+@pytest.mark.parametrize('line, payload', [
+    (b'data: {"a": 1}', b'{"a": 1}'),
+    (b'data:{"a": 1}', b'{"a": 1}'),
+    (b'{"a": 1}', b'{"a": 1}'),
+    (b': ping', None),
+    (b'event: message', None),
+    (b'id: 1', None),
+    (b'retry: 1000', None),
+    (b'data: ', None),
+    (b'data:', None),
+    (b'data: [DONE]', None),
+    (b'', None),
+])
+def test_sse_payload(line, payload):
+    assert _sse_payload(line) == payload
+
+
+def test_iter_sse():
+    # a frame split across chunks, comments and keepalives around it
+    chunks = [
+        b': ping\n\ndata: {"text": "a', b'b"}\n\ndata: \n\n',
+        b'data:{"text": "c"}\n\ndata: [DONE]\n\n'
+    ]
+    assert list(_iter_sse(_Response(chunks))) == [{
+        'text': 'ab'
+    }, {
+        'text': 'c'
+    }]
+
+    # plain json lines of the non-stream path, the last one without newline
+    chunks = [b'{"text": "a"}\n{"te', b'xt": "b"}']
+    assert list(_iter_sse(_Response(chunks))) == [{'text': 'a'}, {'text': 'b'}]
+
+
+def test_bind_pload():
+    pload = _bind_pload(APIClient.chat_interactive_v1, ('hi', ),
+                        dict(session_id=1, top_k=1, adapter='x'))
+    assert pload == dict(prompt='hi',
+                         image_url=None,
+                         session_id=1,
+                         interactive_mode=False,
+                         stream=False,
+                         stop=None,
+                         request_output_len=None,
+                         top_p=0.8,
+                         top_k=1,
+                         temperature=0.8,
+                         repetition_penalty=1.0,
+                         ignore_eos=False,
+                         skip_special_tokens=True,
+                         adapter_name=None,
+                         adapter='x')
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Answer like api_server, streaming three pieces in chunks."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+    def do_GET(self):
+        body = json.dumps({'data': [{'id': 'stub'}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        pload = json.loads(self.rfile.read(length))
+        self.server.requests.append((self.path, self.headers, pload))
+        self.server.ports.append(self.client_address[1])
+        self.send_response(200)
+        if not pload.get('stream'):
+            if self.path == '/v1/chat/interactive':
+                out = dict(text='full', tokens=1, finish_reason='stop')
+            else:
+                out = dict(choices=[dict(message=dict(content='full'))])
+            body = json.dumps(out).encode()
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        if self.path == '/v1/chat/interactive':
+            for i in range(3):
+                finish_reason = 'stop' if i == 2 else None
+                out = dict(text=f't{i}', tokens=i, finish_reason=finish_reason)
+                self._write_chunk(json.dumps(out).encode() + b'\n')
+        else:
+            self._write_chunk(b': ping\n\n')
+            for i in range(3):
+                out = dict(choices=[dict(delta=dict(content=f'd{i}'))])
+                # split the frames across chunks
+                frame = b'data: ' + json.dumps(out).encode() + b'\n\n'
+                self._write_chunk(frame[:7])
+                self._write_chunk(frame[7:])
+                if i == 0 and pload.get('gate'):
+                    # hold the rest back until the client got the first frame
+                    self.server.gated = self.server.gate.wait(5)
+            self._write_chunk(b'data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+@pytest.fixture(scope='module')
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+    server.requests = []
+    server.ports = []
+    server.gate = threading.Event()
+    server.gated = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _url(server):
+    return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+def test_chat_completions_v1(stub_server):
+    client = APIClient(_url(stub_server))
+    outputs = client.chat_completions_v1('stub',
+                                         [dict(role='user', content='hi')],
+                                         stream=True,
+                                         gate=True)
+    first = next(outputs)
+    # the first frame arrives while the server still holds the others back
+    stub_server.gate.set()
+    outputs = [first] + list(outputs)
+    assert stub_server.gated
+    assert [out['choices'][0]['delta']['content']
+            for out in outputs] == ['d0', 'd1', 'd2']
+    path, headers, pload = stub_server.requests[-1]
+    assert path == '/v1/chat/completions'
+    assert headers['Accept-Encoding'] == 'identity'
+    assert headers['Content-Type'] == 'application/json'
+    assert pload['stream'] is True
+    assert pload['temperature'] == 0.7
+
+
+def test_chat_interactive_v1(stub_server):
+    client = APIClient(_url(stub_server), api_key='key')
+    outputs = list(client.chat_interactive_v1('hi', session_id=1))
+    assert outputs == [dict(text='full', tokens=1, finish_reason='stop')]
+    path, headers, pload = stub_server.requests[-1]
+    assert path == '/v1/chat/interactive'
+    assert headers['Authorization'] == 'Bearer key'
+    # a whole answer may be compressed
+    assert headers['Accept-Encoding'] != 'identity'
+    assert pload['stream'] is False
+    assert pload['session_id'] == 1
+
+
+def test_end_session(stub_server):
+    client = APIClient(_url(stub_server))
+    client.end_session(3)
+    path, headers, pload = stub_server.requests[-1]
+    assert path == '/v1/chat/interactive'
+    assert headers['Content-Type'] == 'application/json'
+    assert pload == dict(prompt='',
+                         session_id=3,
+                         request_output_len=0,
+                         interactive_mode=False)
+
+
+@pytest.mark.parametrize('use_session', [False, True])
+def test_get_streaming_response(stub_server, use_session):
+    session = requests.Session() if use_session else None
+    api_url = _url(stub_server) + '/v1/chat/interactive'
+    for _ in range(2):
+        outputs = list(
+            get_streaming_response('hi',
+                                   api_url,
+                                   session_id=1,
+                                   session=session))
+        assert outputs == [('t0', 0, None), ('t1', 1, None), ('t2', 2, 'stop')]
+        _, headers, pload = stub_server.requests[-1]
+        assert headers['Accept-Encoding'] == 'identity'
+        assert headers['Content-Type'] == 'application/json'
+        assert pload['request_output_len'] == 512
+    if use_session:
+        # the second call reuses the connection of the first one
+        assert stub_server.ports[-1] == stub_server.ports[-2]
+
+
+def _collect(api_server_url: str, method: str, *args, **kwargs):
+    """Run an AsyncAPIClient method and gather its outputs."""
+
+    async def _run():
+        async with AsyncAPIClient(api_server_url) as client:
+            return [
+                output
+                async for output in getattr(client, method)(*args, **kwargs)
+            ]
+
+    return asyncio.run(_run())
+
+
+def test_async_chat_completions_v1(stub_server):
+    pytest.importorskip('httpx')
+    outputs = _collect(_url(stub_server),
+                       'chat_completions_v1',
+                       'stub', [dict(role='user', content='hi')],
+                       stream=True)
+    assert [out['choices'][0]['delta']['content']
+            for out in outputs] == ['d0', 'd1', 'd2']
+    path, headers, pload = stub_server.requests[-1]
+    assert path == '/v1/chat/completions'
+    assert headers['Accept-Encoding'] == 'identity'
+    assert pload['stream'] is True
+    assert pload['temperature'] == 0.7
+
+
+def test_async_chat_interactive_v1(stub_server):
+    pytest.importorskip('httpx')
+    outputs = _collect(_url(stub_server),
+                       'chat_interactive_v1',
+                       'hi',
+                       session_id=1,
+                       stream=True)
+    assert [out['text'] for out in outputs] == ['t0', 't1', 't2']
+    assert outputs[-1]['finish_reason'] == 'stop'
+    path, _, pload = stub_server.requests[-1]
+    assert path == '/v1/chat/interactive'
+    # the same defaults as APIClient.chat_interactive_v1
+    assert pload['request_output_len'] is None
+    assert pload['top_p'] == 0.8
+    assert pload['top_k'] == 40
+    assert pload['temperature'] == 0.8
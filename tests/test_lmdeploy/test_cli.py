@@ -0,0 +1,30 @@
+import argparse
+
+import pytest
+
+from lmdeploy.cli.utils import DictAction
+
+
+def test_dict_action():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tm-params',
+                        nargs='*',
+                        default=None,
+                        action=DictAction)
+    args = parser.parse_args([])
+    assert args.tm_params is None
+
+    args = parser.parse_args([
+        '--tm-params', 'a=1', 'b=0.5', 'c=[1,2]', 'd=true', 'e=None',
+        'f=llama', 'g=x=y'
+    ])
+    assert args.tm_params == dict(a=1,
+                                  b=0.5,
+                                  c=[1, 2],
+                                  d=True,
+                                  e=None,
+                                  f='llama',
+                                  g='x=y')
+
+    with pytest.raises(SystemExit):
+        parser.parse_args(['--tm-params', 'a'])